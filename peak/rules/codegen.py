@@ -1,6 +1,6 @@
 from peak.util.assembler import *
 from peak.util.symbols import Symbol
-from peak.rules.core import gen_arg, clone_function, CODE
+from peak.rules.core import gen_arg, clone_function, CODE, reduce
 from peak.rules.ast_builder import build, parse_expr
 from types import ModuleType
 import sys
@@ -451,10 +451,8 @@ class ExprBuilder:
 
     def _multiOp(name, nt):
         def method(self, items):
-            result = build(self,items[0])
-            for item in items[1:]:
-                result = nt(result, build(self,item))
-            return result
+            # left-nested, like Python evaluates them: (a|b)|c, not a|(b|c)
+            return reduce(nt, map(build.__get__(self), items))
         return method
 
     localOps(locals(), _multiOp,
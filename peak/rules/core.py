@@ -12,7 +12,7 @@ from peak.util.decorators import decorate_assignment, decorate, struct, \
             with_metaclass
 
 from peak.util.assembler import Code, Const, Call, Local, Getattr, TryExcept, \
-            Suite, with_name
+            Suite, with_name, If, And, Compare, Return, LocalAssign
 
 from peak.util.addons import AddOn
 import inspect, types, itertools, operator, sys
@@ -112,9 +112,16 @@ def combine_actions(a1,a2):
 
 def rules_for(f):
     """Return the initialized ruleset for a generic function"""
+    d = getattr(f, '__dict__', None)
+    if d is not None and Dispatching in d:
+        # Fast path: this is where AddOn keeps an existing Dispatching
+        return d[Dispatching].rules
     if not Dispatching.exists_for(f):
         d = Dispatching(f)
+        # The clone is just a new function object sharing f's code, globals,
+        # and closure; it keeps f's original body as the default method
         d.rules.add(Rule(clone_function(f)))
+        return d.rules
     return Dispatching(f).rules
 
 
@@ -244,6 +251,15 @@ class MethodType(type):
             always_overrides(other, self)
         return self
 
+def _argnames(body):
+    # Methods are created for every rule and re-created by tail_with(), so
+    # read functions' (and methods') positional arg names from their code
+    # instead of having getargspec() decode it every time
+    code = getattr(body, CODE, None)
+    if code is None:
+        return inspect.getargspec(body)[0]
+    return code.co_varnames[:code.co_argcount]
+
 class Method(with_metaclass(MethodType)):
     """A simple method w/optional chaining"""
 
@@ -254,7 +270,7 @@ class Method(with_metaclass(MethodType)):
         self.tail = tail
         self.can_tail = False
         try:
-            args = inspect.getargspec(body)[0]
+            args = _argnames(body)
         except TypeError:
             pass
         else:
@@ -381,10 +397,23 @@ class RuleSet(object):
 
     synchronized()
     def add(self, rule):
-        actiondefs = frozenset(self._actions_for(rule))
-        self.rules.append( rule )
-        self.actiondefs[rule] = actiondefs
-        self._notify(added=actiondefs)
+        self._add([rule])
+
+    synchronized()
+    def add_many(self, rules):
+        """Add several rules, notifying listeners only once"""
+        self._add(rules)
+
+    def _add(self, rules):
+        # Find all the actions before changing anything, so that an invalid
+        # rule can't leave earlier ones added without notifying listeners
+        new = [(rule, frozenset(self._actions_for(rule))) for rule in rules]
+        added = []
+        for rule, actiondefs in new:
+            self.rules.append( rule )
+            self.actiondefs[rule] = actiondefs
+            added.extend(actiondefs)
+        self._notify(added=added)
 
     synchronized()
     def remove(self, rule):
@@ -405,6 +434,8 @@ class RuleSet(object):
         self._notify(removed=actiondefs)
 
     def _notify(self, added=empty, removed=empty):
+        if not added and not removed:
+            return
         for listener in self.listeners[:]:  # must be re-entrant
             listener.actions_changed(added, removed)
 
@@ -423,7 +454,7 @@ class RuleSet(object):
     def subscribe(self, listener):
         self.listeners.append(listener)
         if self.rules:
-            listener.actions_changed(frozenset(self), empty)
+            listener.actions_changed(list(self), empty)
 
     synchronized()
     def unsubscribe(self, listener):
@@ -455,13 +486,14 @@ class Engine(object):
     reset_on_remove = True
 
     def __init__(self, disp):
+        self.dispatching = disp
         self.function = disp.function
         self.registry = {}
         self.closures = {}
         self.rules = disp.rules
         self.__lock__ = disp.get_lock()
-        self.argnames = list(
-            flatten(filter(None, inspect.getargspec(self.function)[:3]))
+        self.argnames = flatten(
+            filter(None, inspect.getargspec(self.function)[:3])
         )
         self.rules.subscribe(self)
 
@@ -478,13 +510,13 @@ class Engine(object):
 
     def _changed(self):
         """Some change to the rules has occurred"""
-        Dispatching(self.function).request_regeneration()
+        self.dispatching.request_regeneration()
 
     def _full_reset(self):
         """Regenerate any code, caches, indexes, etc."""
         self.registry.clear()
         self.actions_changed(self.rules, ())
-        Dispatching(self.function).request_regeneration()
+        self.dispatching.request_regeneration()
 
 
 
@@ -498,9 +530,8 @@ class Engine(object):
         except (KeyError, TypeError, AttributeError):
             pass
 
-        try:
-            closure = self.closures[template]
-        except KeyError:
+        closure = self.closures.get(template)
+        if closure is None:
             if getattr(template, CLOSURE):
                 raise TypeError("Templates cannot use outer-scope variables")
             import linecache; from peak.util.decorators import cache_source
@@ -535,10 +566,10 @@ class Engine(object):
         """Add a case for the given signature and rule"""
         registry = self.registry
         action = rule.actiontype(rule.body, signature, rule.sequence)
-        if signature in registry:
-            registry[signature] = combine_actions(registry[signature], action)
-        else:
-            registry[signature] = action
+        # Usually there's just one rule per signature, so nothing to combine
+        old = registry.setdefault(signature, action)
+        if old is not action:
+            registry[signature] = combine_actions(old, action)
         return action
 
     def _remove_method(self, signature, rule):
@@ -576,14 +607,30 @@ class TypeEngine(Engine):
     """Simple type-based dispatching"""
 
     cache = None
+    inline_limit = 4    # most exact-type tests to emit ahead of the cache
 
     def __init__(self, disp):
+        # The function's signature never changes, so the names of the args
+        # dispatched on, the code to find their types, and the arguments for
+        # calling through to a method are all built just once, not per-regen
+        args, star, dstar, defaults = inspect.getargspec(disp.function)
+        self.arg_spec = args
+        self.typed_args = flatten(args)
+        self.arg_types = [class_or_type_of(Local(n)) for n in self.typed_args]
+        self.call_args = list(map(gen_arg, args)), gen_arg(star), gen_arg(dstar)
         self.static_cache = {}
+        self.compiled = {}  # {id(action): (action, compiled action)}
+        self.signatures = []    # registry keys, in the order first added
+        self.observed = []  # types seen on cache misses, or None if too many
         super(TypeEngine, self).__init__(disp)
 
     def _changed(self):
-        if self.cache != self.static_cache:
-            Dispatching(self.function).request_regeneration()
+        self.compiled.clear()
+        # Code is only regenerated on the next call, so once that's pending,
+        # further changes (e.g. a module defining many rules) cost nothing
+        disp = self.dispatching
+        if disp.backup is None and self.cache != self.static_cache:
+            disp.request_regeneration()
 
     def _bootstrap(self):
         # Bootstrap a self-referential generic function by ensuring an exact
@@ -600,6 +647,8 @@ class TypeEngine(Engine):
         self._changed()
 
     def _add_method(self, signature, rule):
+        if signature not in self.registry:
+            self.signatures.append(signature)
         action = super(TypeEngine, self)._add_method(signature, rule)
         cache = self.static_cache
         for key in cache.keys():
@@ -607,35 +656,98 @@ class TypeEngine(Engine):
                 del cache[key]
         return action
 
+    def _full_reset(self):
+        del self.signatures[:]
+        super(TypeEngine, self)._full_reset()
 
-
-
-
-
+    def _resolve(self, types):
+        """Return the compiled action for an exact tuple of argument types"""
+        key = tuple(map(istype, types))
+        action = self.rules.default_action
+        registry = self.registry
+        for sig in self.signatures:
+            if implies(key, sig):
+                action = combine_actions(action, registry[sig])
+        # Many type tuples resolve to the same action, so compile it just once
+        compiled = self.compiled
+        if id(action) not in compiled:
+            compiled[id(action)] = action, compile_method(action, self)
+        return compiled[id(action)][1]
+
+    def _observe(self, types):
+        """Note types seen on a cache miss, respecializing the code for them"""
+        observed = self.observed
+        if observed is None or not types:
+            return
+        if len(observed)<self.inline_limit:
+            observed.append(types)
+        else:
+            # Too many types to test inline: stick with the cache from now on
+            self.observed = None
+        self.dispatching.request_regeneration()
+
+    def _inline_cases(self, cache, nargs):
+        """Resolve a few exact types (seen or registered) to test inline"""
+        if self.observed is None:
+            return []   # too many types seen for any tests to pay off
+        keys = list(self.observed)
+        for sig in self.signatures:
+            for key in type_keys(sig):
+                if len(key)==nargs and key not in keys:
+                    keys.append(key)
+        if len(keys)>self.inline_limit:
+            # a dict lookup is cheaper than a long chain of tests, so only
+            # test for the types actually seen
+            keys = list(self.observed)
+        cases = []
+        for key in keys:
+            if key not in cache:
+                try:
+                    cache[key] = self._resolve(key)
+                except DispatchError:
+                    continue    # leave it for the callback to report on call
+            cases.append((key, cache[key]))
+        return cases
 
     def _generate_code(self):
         self.cache = cache = self.static_cache.copy()
+        spec = self.arg_spec
         def callback(*args, **kw):
-            types = tuple([getattr(arg,'__class__',type(arg)) for arg in args])
-            key = tuple(map(istype, types))
+            # Key on the dispatched arguments' types only, like the cache
+            # lookup does (i.e. not on any *args)
+            types = tuple(_arg_types(spec, args))
             self.__lock__.acquire()
             try:
-                action = self.rules.default_action
-                for sig in self.registry:
-                    if implies(key, sig):
-                        action = combine_actions(action, self.registry[sig])
-                f = cache[types] = compile_method(action, self)
+                f = cache[types] = self._resolve(types)
+                self._observe(types)
             finally:
                 self.__lock__.release()
             return f(*args, **kw)
 
         c = Code.from_function(self.function, copy_lineno=True)
-        types = [class_or_type_of(Local(name))
-                    for name in flatten(inspect.getargspec(self.function)[0])]
+        names, types = self.typed_args, self.arg_types
+        cases = names and self._inline_cases(cache, len(names))
+        if cases:
+            # Compute each argument's type just once, then try the exact
+            # types we expect to see most, before using the cache
+            temps = [Local('$type_'+name) for name in names]
+            for expr, temp in zip(types, temps):
+                c(expr, LocalAssign(temp.name))
+            types = temps
+            for key, f in cases:
+                c(If(
+                    And([Compare(t, [('is', Const(k))])
+                            for t, k in zip(types, key)]),
+                    Return(self._call_thru(Const(f)))
+                ))
         target = Call(Const(cache.get), (tuple(types), Const(callback)))
-        c.return_(call_thru(self.function, target))
+        c.return_(self._call_thru(target))
         return c.code()
 
+    def _call_thru(self, target):
+        args, star, dstar = self.call_args
+        return Call(target, args, (), star, dstar, fold=False)
+
 
 # Handle alternates in tuple signatures
 #
@@ -657,13 +769,34 @@ def _tuple_disjuncts(ob):
 # Code generation stuff
 
 def flatten(v):
-    if isinstance(v,basestring): yield v; return
-    for i in v:
-        for ii in flatten(i): yield ii
+    """Return a list of the strings in `v`, which may be nested sequences"""
+    strings = basestring
+    if isinstance(v,strings): return [v]
+    out, stack = [], [iter(v)]
+    while stack:
+        for i in stack[-1]:
+            if isinstance(i,strings):
+                out.append(i)
+            else:
+                stack.append(iter(i))   # descend, resuming here afterwards
+                break
+        else:
+            stack.pop()
+    return out
 
 def gen_arg(v):
     if isinstance(v,basestring): return Local(v)
-    if isinstance(v,list): return tuple(map(gen_arg,v))
+    if type(v) is list: return tuple(map(gen_arg,v))  # as from getargspec()
+
+def _arg_types(spec, values):
+    """Classes of the arguments named by (possibly nested) argspec `spec`"""
+    types = []
+    for name, value in zip(spec, values):
+        if type(name) is list:
+            types.extend(_arg_types(name, value))
+        else:
+            types.append(getattr(value, '__class__', type(value)))
+    return types
 
 def call_thru(sigfunc, target, prefix=()):
     args, star, dstar, defaults = inspect.getargspec(sigfunc)
@@ -759,7 +892,7 @@ def tuple_implies(s1,s2):
     if len(s2)>len(s1):
         return False    # shorter tuple can't imply longer tuple
     for t1,t2 in zip(s1,s2):
-        if not implies(t1,t2):
+        if t1 is not t2 and not implies(t1,t2):   # anything implies itself
             return False
     else:
         return True
@@ -904,18 +1037,20 @@ class MethodList(Method):
         if self._sorted_items is not None:
             return self._sorted_items
 
-        self.items.sort()
+        self.items = sorted(self.items, key=lambda item: item[0])
         rest = [(s,b) for (serial, s, b) in self.items]
 
         self._sorted_items = items = []
         seen = set()
         while rest:
-            best = dominant_signatures(rest)
-            list(map(rest.remove, best))
-            for s,b in best:
+            best = _dominant_positions(rest)
+            for posn in best:
+                s, b = rest[posn]
                 if b not in seen:
                     seen.add(b)
                     items.append((s,b))
+            best = set(best)
+            rest = [case for posn, case in enumerate(rest) if posn not in best]
         return items
 
 def list_template(__func, __bodies, __wrappers):
@@ -1078,28 +1213,42 @@ def dominant_signatures(cases):
         # Shortcut for common case
         return list(cases)
 
-    best, rest = list(cases[:1]), list(cases[1:])
+    return [cases[posn] for posn in _dominant_positions(cases)]
+
+def _dominant_positions(cases):
+    """Return the (ascending) positions of ``dominant_signatures(cases)``"""
 
-    for new_sig, new_meth in rest:
+    best = []
+    if cases:
+        best = [0]
 
-        for old_sig, old_meth in best[:]:   # copy so we can modify inplace
+    for new in range(1, len(cases)):
+        new_sig = cases[new][0]
+        survivors = []  # build a new list instead of removing from the old
 
-            new_implies_old = implies(new_sig, old_sig)
-            old_implies_new = implies(old_sig, new_sig)
+        for n, old in enumerate(best):
+            old_sig = cases[old][0]
 
-            if new_implies_old:
+            if implies(new_sig, old_sig):
 
-                if not old_implies_new:
-                    # better, remove the old one
-                    best.remove((old_sig, old_meth))
+                if implies(old_sig, new_sig):
+                    # equivalent, keep the old one too
+                    survivors.append(old)
+                # otherwise better, so the old one is dropped
 
-            elif old_implies_new:
+            elif implies(old_sig, new_sig):
                 # worse, skip adding the new one
+                survivors.extend(best[n:])
                 break
+
+            else:
+                survivors.append(old)
         else:
             # new_sig has passed the gauntlet, as it has not been implied
             # by any of the current "best" items
-            best.append((new_sig,new_meth))
+            survivors.append(new)
+
+        best = survivors
 
     return best
 
@@ -1,4 +1,4 @@
-from peak.rules.core import when, value
+from peak.rules.core import when, value, rules_for, Dispatching, TypeEngine
 from peak.util.assembler import *
 from peak.rules.codegen import *
 
@@ -53,12 +53,40 @@ for prec, group in enumerate([
         if not issubclass(cls, prec_ops):
             prec_ops += (cls,)
 
+class _TypeMemo(dict):
+    """Per-class memo of a generic function, while its rules only test types"""
+
+    def __init__(self, gf):
+        self.gf = gf
+        self.dispatching = Dispatching(gf)
+        self.by_type = True
+        rules_for(gf).subscribe(self)
+
+    def actions_changed(self, added, removed):
+        self.clear()    # forget everything when the function's rules change
+        # Once there are predicate rules, results can depend on more than type
+        self.by_type = self.dispatching.engine.__class__ is TypeEngine
+
+    def __call__(self, ob):
+        if not self.by_type:
+            return self.gf(ob)
+        cls = ob.__class__
+        if cls in self:
+            return self[cls]
+        result = self[cls] = self.gf(ob)
+        return result
+
+# Precedence is checked for every operator in an expression, so avoid
+# dispatching more than once per node type
+_precedence = _TypeMemo(precedence)
+_associativity = _TypeMemo(associativity)
+
 when(needs_parens, (prec_ops, prec_ops))
 def prec_parens(parent, child, posn):
-    pprec = precedence(parent)
-    pchild = precedence(child)
+    pprec = _precedence(parent)
+    pchild = _precedence(child)
     if pprec < pchild: return True
-    passoc = associativity(parent)
+    passoc = _associativity(parent)
     return pprec==pchild and passoc is not None and posn != passoc 
 
 when(needs_parens, (Power, (Plus, Minus, Invert)))
@@ -289,7 +289,7 @@ def _expand_as(func, predicate_string, *namespaces):
     """Pre-parse predicate string and register meta function"""
 
     args, varargs, kw, defaults = arginfo = inspect.getargspec(func)
-    argnames = list(flatten(filter(None, [args, varargs, kw])))
+    argnames = flatten(filter(None, [args, varargs, kw]))
     parsed = parser.expr(predicate_string).totuple(1)[1]
     builder = CriteriaBuilder(
         dict([(arg,Local(arg)) for arg in argnames]), *namespaces
@@ -447,7 +447,7 @@ class IndexedEngine(Engine, TreeBuilder):
 
     def _full_reset(self):
         # Replace the entire engine with a new one
-        Dispatching(self.function).create_engine(self.__class__)
+        self.dispatching.create_engine(self.__class__)
 
     synchronized()
     def seed_bits(self, expr, cases):
@@ -542,12 +542,12 @@ def class_node(builder, expr, cases, remaining_exprs, memo):
     dontcares, seedmap = builder.seed_bits(expr, cases)
     cache = {}
     def lookup_fn(cls):
-        try:
-            inc, exc = seedmap[cls]
-        except KeyError:
+        bits = seedmap.get(cls)
+        if bits is None:
             builder.reseed(expr, Class(cls))
             seedmap.update(builder.seed_bits(expr, cases)[1])
-            inc, exc = seedmap[cls]
+            bits = seedmap[cls]
+        inc, exc = bits
         cbits = dontcares | inc
         cbits ^= (exc & cbits)
         return cache.setdefault(cls, builder.build(cbits,remaining_exprs,memo))
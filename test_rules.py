@@ -39,6 +39,127 @@ class TypeEngineTests(unittest.TestCase):
         self.assertEqual(f(1), 42)
         self.assertEqual(f('x'), 'x')
 
+    def testExactTypesAndSubclasses(self):
+        abstract()
+        def f(a, b):
+            """blah"""
+
+        when(f, (int, int))(lambda a, b: "ii")
+        r = Rule(lambda a, b: "io", (int, object), Method)
+        rules_for(f).add(r)
+        self.assertEqual(f(1, 2), "ii")
+        self.assertEqual(f(1, 'x'), "io")
+        self.assertEqual(f(True, 2), "ii")
+
+        when(f, (bool, int))(lambda a, b: "bi")
+        self.assertEqual(f(True, 2), "bi")
+        self.assertEqual(f(1, 2), "ii")
+
+        around(f, (int, int))(lambda a, b: 42)
+        self.assertEqual(f(1, 2), 42)
+
+        rules_for(f).remove(r)
+        self.assertRaises(NoApplicableMethods, f, 1, 'x')
+        self.assertEqual(f(1, 2), 42)
+
+    def testObservedTypes(self):
+        abstract()
+        def f(a):
+            """blah"""
+
+        when(f, (int,))(lambda a: "int")
+        engine = Dispatching(f).engine
+        self.assertEqual(f(True), "int")
+        self.assertEqual(engine.observed, [(bool,)])
+        self.assertEqual(f(True), "int")
+
+        when(f, (bool,))(lambda a: "bool")
+        self.assertEqual(f(True), "bool")
+        self.assertEqual(f(1), "int")
+
+        for n in range(engine.inline_limit):
+            self.assertEqual(f(type('I%d' % n, (int,), {})()), "int")
+        self.assertEqual(engine.observed, None)
+        self.assertEqual(f(True), "bool")
+        self.assertEqual(f(1), "int")
+
+    def testVarargsCacheKeys(self):
+        def f(a, *rest):
+            return "f"
+        when(f, (int,))(lambda a, *rest: "int")
+        self.assertEqual(f('x', 2, 3), "f")
+        self.assertEqual(f(1, 'y'), "int")
+        cache = Dispatching(f).engine.cache
+        self.failUnless((str,) in cache)
+        self.failIf((str, int, int) in cache)
+
+    def testImpliesAfterRuleChanges(self):
+        try:
+            from abc import ABCMeta
+        except ImportError:
+            return
+        A = ABCMeta('A', (object,), {})
+        class X(object): pass
+        def f(ob): return "default"
+        when(f, (A,))(lambda ob: "A")
+        self.assertEqual(f(X()), "default")
+        A.register(X)
+        when(f, (int,))(lambda ob: "int")
+        self.assertEqual(f(X()), "A")
+
+    def testFalseMethodsAreCached(self):
+        class Empty(object):
+            def __len__(self): return 0
+            def __call__(self, ob): return "empty"
+        def f(ob): pass
+        when(f, (object,))(Empty())
+        engine = Dispatching(f).engine
+        resolved = []
+        def _resolve(types, resolve=engine._resolve):
+            resolved.append(types)
+            return resolve(types)
+        engine._resolve = _resolve
+        classes = [type(name, (object,), {}) for name in 'ABCDEF']
+        for i in range(2):
+            for cls in classes:
+                self.assertEqual(f(cls()), "empty")
+        del resolved[:]
+        for cls in classes:
+            self.assertEqual(f(cls()), "empty")
+        self.assertEqual(resolved, [])
+
+    def testAmbiguityOrderAfterReset(self):
+        def g(x): return "g"
+        when(g, ())(lambda x: "gg")
+        def serials():
+            try:
+                g(1)
+            except AmbiguousMethods:
+                methods = sys.exc_info()[1].methods
+                return [getattr(m, 'serial', None) for m in methods]
+            self.fail("should be ambiguous")
+        before = serials()
+        rule = Rule(lambda x: "float", (float,))
+        rules_for(g).add(rule)
+        rules_for(g).remove(rule)   # forces a full reset
+        self.assertEqual(serials(), before)
+
+    def testAmbiguityOrder(self):
+        bases = [type(name, (object,), {}) for name in 'ABCDEFGH']
+        both = type('Both', tuple(bases), {})
+        def f(ob): pass
+        for base in bases:
+            when(f, (base,))(lambda ob, name=base.__name__: name)
+        try:
+            f(both())
+        except AmbiguousMethods:
+            e = sys.exc_info()[1]
+        else:
+            self.fail("should be ambiguous")
+        serials = [m.serial for m in e.methods]
+        self.assertEqual(len(serials), len(bases))
+        self.assertEqual(serials, sorted(serials))
+
 class MiscTests(unittest.TestCase):
     def testPointers(self):
         from peak.rules.indexing import IsObject
@@ -322,6 +443,31 @@ class MiscTests(unittest.TestCase):
         rs.clear()
         self.assertEqual(list(rs), [])
 
+    def testIndexedAmbiguityOrder(self):
+        bases = [type(name, (object,), {}) for name in 'ABCDEFGH']
+        both = type('Both', tuple(bases), {})
+        def f(ob): pass
+        for base in bases:
+            when(f, (base,))(lambda ob, name=base.__name__: name)
+        # upgrading the engine re-adds all the rules at once
+        when(f, "ob == 42")(lambda ob: 42)
+        try:
+            f(both())
+        except AmbiguousMethods:
+            e = sys.exc_info()[1]
+        else:
+            self.fail("should be ambiguous")
+        serials = [m.serial for m in e.methods]
+        self.assertEqual(len(serials), len(bases))
+        self.assertEqual(serials, sorted(serials))
+
+    def testRuleSetAddManyFailure(self):
+        from peak.rules.core import Rule, RuleSet
+        rs = RuleSet(); r = Rule(lambda:None,actiontype=Method)
+        self.assertRaises(TypeError, rs.add_many, [r, None])
+        self.assertEqual(rs.rules, [])
+        self.assertEqual(list(rs), [])
+
 
 
 
@@ -695,6 +841,17 @@ class DecompilationTests(unittest.TestCase):
         # TODO: Compare
 
 
+    def test_type_memo(self):
+        from peak.rules.debug.decompile import _TypeMemo
+        def f(ob): return 0
+        memo = _TypeMemo(f)
+        self.assertEqual(memo(1), 0)
+        when(f, (int,))(lambda ob: 1)
+        self.assertEqual(memo(1), 1)
+        when(f, "isinstance(ob, int) and ob==2")(lambda ob: 2)
+        self.assertEqual(memo(1), 1)
+        self.assertEqual(memo(2), 2)
+
     def test_slices(self):
         self.roundtrip('a[:]')
         self.roundtrip('a[1:]')